@@ -1,7 +1,32 @@
 import streamlit as st
 import pandas as pd
+import re
+import threading
+import time
 import requests
-from typing import List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, List, Optional
+from urllib.parse import quote_plus
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # stdlib json also accepts bytes
+    import json
+    _loads = json.loads
+
+try:
+    import brotli  # noqa: F401 -- lets urllib3 decode br-encoded responses
+    _ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    _ACCEPT_ENCODING = "gzip"
+
+try:
+    import diskcache
+except ImportError:  # fall back to the in-process cache only
+    diskcache = None
 
 st.set_page_config(page_title="RxNorm Drug Search", page_icon="💊", layout="wide")
 
@@ -9,74 +34,243 @@ st.title("💊 RxNorm Drug Search")
 st.markdown("Search drug info via NLM’s RxNorm API")
 st.markdown("---")
 
-def get_rxcui_for_ingredient(term: str) -> Optional[str]:
-    url = f"https://rxnav.nlm.nih.gov/REST/approximateTerm.json?term={term}&maxEntries=1"
-    try:
-        r = requests.get(url, timeout=5); r.raise_for_status()
-        c = r.json().get('approximateGroup', {}).get('candidate', [])
-        return c[0]['rxcui'] if c else None
-    except:
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Shared keep-alive session; cached so script reruns reuse the same connection pool."""
+    s = requests.Session()
+    s.headers.update({"Accept": "application/json", "Accept-Encoding": _ACCEPT_ENCODING,
+                      "User-Agent": "rxnorm-streamlit/1.0"})
+    # Retry connect errors and throttling/5xx, but not read timeouts: a hung RxNav would multiply the wait
+    retries = Retry(total=3, read=False, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+    s.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries))
+    return s
+
+SESSION = get_session()
+
+@st.cache_resource
+def get_disk_cache():
+    """Response cache that survives restarts; None when diskcache isn't installed."""
+    if diskcache is None:
         return None
+    return diskcache.Cache("/tmp/rxnorm_cache", size_limit=64 * 1024 * 1024)
+
+DISK_CACHE = get_disk_cache()
 
-def call_endpoint(url: str, source: str) -> List[dict]:
-    """Generic GET for RxNorm endpoints, extracting conceptProperties."""
+# RxNorm concepts/relations change at most with the monthly release; drug listings are refreshed more often
+DRUGS_TTL = 3600
+CONCEPT_TTL = 7 * 24 * 3600
+HTTP_TIMEOUT = (3.05, 10)  # (connect, read)
+RESULT_COLUMNS = ['rxcui', 'name', 'termType', 'source']
+# Every result column is text; Arrow-backed strings skip object-dtype inference (pyarrow ships with streamlit)
+RESULT_DTYPE = "string[pyarrow]"
+# Terms without two consecutive letters can't name a drug; skip the network for them
+_SEARCHABLE_RE = re.compile(r"[A-Za-z]{2,}")
+_OK_SUPPRESS = frozenset(('', 'N'))
+
+def _get_json(url: str, ttl: int) -> dict:
+    """GET via the disk cache; stale entries are revalidated with ETag/Last-Modified
+    and served as-is if RxNav fails or returns an undecodable body."""
+    entry = DISK_CACHE.get(url) if DISK_CACHE is not None else None
+    cached = isinstance(entry, tuple)
+    headers = {}
+    if cached:
+        fetched_at, etag, last_mod, payload = entry
+        if time.time() - fetched_at < ttl:
+            return payload
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_mod:
+            headers['If-Modified-Since'] = last_mod
     try:
-        r = requests.get(url, timeout=5); r.raise_for_status()
-        items = r.json().get('drugGroup' if 'drugs.json' in url else 'relatedGroup', {})
-        groups = items.get('conceptGroup', [])
-        data = []
-        for g in groups:
-            for c in g.get('conceptProperties', []):
-                if c.get('suppress', '') not in ['N', '']:
-                    continue
-                data.append({
-                    'rxcui': c['rxcui'],
-                    'name': c.get('name') or c.get('synonym'),
-                    'termType': c.get('tty'),
-                    'source': source
-                })
-        return data
-    except:
-        return []
-
-@st.cache_data(ttl=3600)
+        r = SESSION.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        if r.status_code == 304 and headers:
+            data = payload
+            etag = r.headers.get('ETag', etag)
+            last_mod = r.headers.get('Last-Modified', last_mod)
+        else:
+            r.raise_for_status()
+            data = _loads(r.content)
+            etag, last_mod = r.headers.get('ETag'), r.headers.get('Last-Modified')
+    except (requests.RequestException, ValueError):  # ValueError: undecodable body
+        if cached:
+            return payload
+        raise
+    if DISK_CACHE is not None:
+        DISK_CACHE.set(url, (time.time(), etag, last_mod, data))
+    return data
+
+@st.cache_data(ttl=DRUGS_TTL, max_entries=2048, show_spinner=False)
+def _fetch_drugs_json(url: str) -> dict:
+    return _get_json(url, DRUGS_TTL)
+
+@st.cache_data(ttl=CONCEPT_TTL, max_entries=2048, show_spinner=False)
+def _fetch_concept_json(url: str) -> dict:
+    return _get_json(url, CONCEPT_TTL)
+
+def _fetch_json(url: str) -> dict:
+    """Cached GET keyed on URL; failures raise and are never cached."""
+    return _fetch_drugs_json(url) if 'drugs.json' in url else _fetch_concept_json(url)
+
+def get_rxcui_for_ingredient(term: str) -> Optional[str]:
+    term = term.strip().casefold()
+    url = f"https://rxnav.nlm.nih.gov/REST/approximateTerm.json?term={quote_plus(term)}&maxEntries=1"
+    c = _fetch_json(url).get('approximateGroup', {}).get('candidate', [])
+    return c[0]['rxcui'] if c else None
+
+def _empty_columns() -> Dict[str, list]:
+    return {col: [] for col in RESULT_COLUMNS}
+
+def _parse_concepts(payload: dict, source: str) -> Dict[str, list]:
+    """Project conceptProperties into per-column lists keyed by RESULT_COLUMNS."""
+    items = payload.get('drugGroup') or payload.get('relatedGroup') or {}
+    groups = items.get('conceptGroup', [])
+    rxcuis, names, ttys = [], [], []
+    add_rxcui, add_name, add_tty = rxcuis.append, names.append, ttys.append
+    for g in groups:
+        for c in g.get('conceptProperties', ()):
+            get = c.get
+            if get('suppress', '') not in _OK_SUPPRESS:
+                continue
+            name = get('name') or get('synonym')
+            if not name:
+                continue
+            add_rxcui(c['rxcui'])
+            add_name(name)
+            add_tty(get('tty'))
+    return {'rxcui': rxcuis, 'name': names, 'termType': ttys, 'source': [source] * len(rxcuis)}
+
+def call_endpoint(url: str, source: str) -> Dict[str, list]:
+    """Generic GET for RxNorm endpoints, extracting conceptProperties.
+
+    Fetch errors propagate so search_rxnorm_api fails instead of caching a partial result."""
+    return _parse_concepts(_fetch_json(url), source)
+
+# Called from worker threads too, so no cache spinner; the UI shows its own
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
 def search_rxnorm_api(term: str) -> pd.DataFrame:
-    term = term.strip()
-    results = []
+    term = term.strip().casefold()
+    if not _SEARCHABLE_RE.search(term):
+        return pd.DataFrame(columns=RESULT_COLUMNS, dtype=RESULT_DTYPE)
+    rx_url = f"https://rxnav.nlm.nih.gov/REST/drugs.json?name={quote_plus(term)}"
+
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        # 1. Run getDrugs (ingredient-based clinical & brand) alongside the ingredient RxCUI lookup
+        f_direct = ex.submit(call_endpoint, rx_url, 'direct')
+        f_rxcui = ex.submit(get_rxcui_for_ingredient, term)
+
+        # 2. Ingredient RxCUI → branded & clinical via related.json, started from whichever lookup
+        #    yields an RxCUI first: an exact IN hit in getDrugs, or approximateTerm (which is
+        #    always sent, and joined when the pool exits)
+        rxcui = f_related = None
+        pending = {f_direct, f_rxcui}
+        while pending and not f_related:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if f_direct in done:
+                direct = f_direct.result()
+                rxcui = next((rid for rid, name, tty in zip(direct['rxcui'], direct['name'], direct['termType'])
+                              if tty == 'IN' and name.casefold() == term), None)
+            if not rxcui and f_rxcui in done:
+                rxcui = f_rxcui.result()
+            if rxcui:
+                url2 = f"https://rxnav.nlm.nih.gov/REST/rxcui/{rxcui}/related.json?tty=BN+SBD+SCD"
+                f_related = ex.submit(call_endpoint, url2, 'related')
+
+        parts = [f_direct.result()]
+        if f_related:
+            parts.append(f_related.result())
 
-    # 1. Run getDrugs (ingredient-based clinical & brand)
-    rx_url = f"https://rxnav.nlm.nih.gov/REST/drugs.json?name={term}"
-    results += call_endpoint(rx_url, 'direct')
+    merged = _empty_columns()
+    for part in parts:
+        for col in RESULT_COLUMNS:
+            merged[col].extend(part[col])
 
-    # 2. Ingredient RxCUI → getDrugs by name again via that term for consistency
-    rxcui = get_rxcui_for_ingredient(term)
-    if rxcui:
-        ingredient_url = f"https://rxnav.nlm.nih.gov/REST/drugs.json?name={term}"
-        results += call_endpoint(ingredient_url, 'ingredient')
+    # Dedup on rxcui before building the frame; first source wins, as with drop_duplicates
+    seen = set()
+    keep = []
+    for i, rid in enumerate(merged['rxcui']):
+        if rid and rid not in seen:
+            seen.add(rid)
+            keep.append(i)
+    names = merged['name']
+    keep.sort(key=lambda i: names[i].casefold())
+    return pd.DataFrame({col: [merged[col][i] for i in keep] for col in RESULT_COLUMNS}, dtype=RESULT_DTYPE)
 
-    # 3. Ingredient RxCUI → branded & clinical via related.json
-    if rxcui:
-        url2 = f"https://rxnav.nlm.nih.gov/REST/rxcui/{rxcui}/related.json?tty=BN+SBD+SCD"
-        results += call_endpoint(url2, 'related')
+# Each term costs up to 3 RxNav calls, so a single pasted list is capped
+MAX_BATCH_TERMS = 10
 
-    df = pd.DataFrame(results).drop_duplicates('rxcui')
-    return df[df['name'].notna()].sort_values('name').reset_index(drop=True)
+def split_terms(q: str) -> List[str]:
+    """Normalised, de-duplicated terms from a comma-separated query."""
+    return list(dict.fromkeys(t.strip().casefold() for t in q.split(',') if t.strip()))
+
+def search_rxnorm_batch(terms: List[str]) -> pd.DataFrame:
+    """Search up to MAX_BATCH_TERMS terms concurrently; rows are tagged with the query they came from."""
+    terms = terms[:MAX_BATCH_TERMS]
+    # Each search fans out 2-3 calls itself, so keep the batch pool small for RxNav's rate limits
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        frames = list(ex.map(search_rxnorm_api, terms))
+    frames = [df.assign(query=pd.Series(t, index=df.index, dtype=RESULT_DTYPE))
+              for t, df in zip(terms, frames) if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=['query'] + RESULT_COLUMNS, dtype=RESULT_DTYPE)
+    return pd.concat(frames, ignore_index=True)[['query'] + RESULT_COLUMNS]
+
+# Frequently searched US drugs, pre-fetched so their first search hits the caches
+HOT_TERMS = [
+    "acetaminophen", "ibuprofen", "omeprazole", "atorvastatin", "lisinopril", "metformin",
+    "amlodipine", "metoprolol", "levothyroxine", "simvastatin", "losartan", "albuterol",
+    "gabapentin", "hydrochlorothiazide", "sertraline", "furosemide", "pantoprazole",
+    "prednisone", "amoxicillin", "escitalopram", "rosuvastatin", "montelukast",
+    "fluticasone", "tramadol", "trazodone", "insulin glargine", "clopidogrel", "aspirin",
+    "cetirizine", "warfarin",
+]
+
+def _warm_cache():
+    # Fill only the URL-level caches; a failed fetch stores nothing and is retried on first search
+    for t in HOT_TERMS:
+        try:
+            _fetch_json(f"https://rxnav.nlm.nih.gov/REST/drugs.json?name={quote_plus(t)}")
+            rxcui = get_rxcui_for_ingredient(t)
+            if rxcui:
+                _fetch_json(f"https://rxnav.nlm.nih.gov/REST/rxcui/{rxcui}/related.json?tty=BN+SBD+SCD")
+        except Exception:
+            pass
+
+@st.cache_resource
+def start_cache_warmup() -> threading.Thread:
+    """Warm the caches once per process, in the background."""
+    t = threading.Thread(target=_warm_cache, name="rxnorm-warmup", daemon=True)
+    t.start()
+    return t
+
+start_cache_warmup()
 
 # UI
-col1, col2 = st.columns([3,1])
-with col1:
-    q = st.text_input("Enter drug name:", placeholder="e.g. acetaminophen, ibuprofen")
-with col2:
-    if st.button("🔍 Search"):
-        st.rerun()
-
-if q and len(q.strip())>=2:
-    with st.spinner(f"Searching '{q}'..."):
-        df = search_rxnorm_api(q)
-    if not df.empty:
-        st.success(f"Found {len(df)} results:")
-        st.dataframe(df, use_container_width=True)
+# A form only reruns the script on submit (button or Enter), not on every edit
+with st.form("search_form", clear_on_submit=False):
+    q = st.text_input("Enter drug name:", placeholder="e.g. acetaminophen, or several comma-separated: ibuprofen, naproxen")
+    submitted = st.form_submit_button("🔍 Search")
+
+if not submitted:
+    st.info("Enter a drug name and press Enter or 🔍 Search.")
+elif q and len(q.strip())>=2:
+    try:
+        with st.spinner(f"Searching '{q}'..."):
+            if ',' in q:
+                terms = split_terms(q)
+                if len(terms) > MAX_BATCH_TERMS:
+                    st.warning(f"Searching the first {MAX_BATCH_TERMS} of {len(terms)} terms; "
+                               f"skipped: {', '.join(terms[MAX_BATCH_TERMS:])}")
+                df = search_rxnorm_batch(terms)
+            else:
+                df = search_rxnorm_api(q.strip().casefold())
+    except Exception as e:
+        # Not cached: search_rxnorm_api raised, so the next submit retries RxNav
+        st.error(f"RxNorm lookup failed, please try again shortly: {e}")
     else:
-        st.warning(f"No results for '{q}'.")
+        if not df.empty:
+            st.success(f"Found {len(df)} results:")
+            st.dataframe(df, use_container_width=True)
+        else:
+            st.warning(f"No results for '{q}'.")
 else:
     st.info("Enter at least 2 characters to search.")